@@ -1,12 +1,15 @@
 from google.cloud import bigquery
 import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
 import re
 import numpy as np
+from numba import njit, prange
 import streamlit as st
 import os
 import pickle
+import hashlib
+import scipy.sparse
 import plotly.express as px
 import plotly.graph_objects as go
 from collections import Counter
@@ -14,66 +17,206 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import streamlit.components.v1 as components  # Added for embedding
 
+try:
+    import hnswlib
+except ImportError:  # Fall back to an exact scan over the embeddings
+    hnswlib = None
+
 # Initialize BigQuery client
 client = bigquery.Client()
 
 # File path for caching
-CACHE_FILE = "steam_games_cache.pkl"
+CACHE_FILE = "steam_games_cache.feather"
+LEGACY_CACHE_FILE = "steam_games_cache.pkl"
+INDEX_FILE = "steam_games_hnsw_tfidf_{fingerprint}.bin"
+TFIDF_MATRIX_FILE = "tfidf_{fingerprint}.npz"
+
+# HNSW search breadth
+HNSW_EF = 100
+
+# Characters stripped from genre and tag tokens
+CLEAN_TEXT_RE = re.compile(r'[^\w\s]')
+
+# Function to save the DataFrame cache as uncompressed Feather
+def save_cache(df):
+    df.reset_index(drop=True).to_feather(CACHE_FILE, compression='uncompressed')
 
 # Function to fetch data from BigQuery and cache it
 def load_data():
     if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, 'rb') as f:
-            df = pickle.load(f)
+        df = pd.read_feather(CACHE_FILE)
         st.info("Loaded data from local cache.")
+    elif os.path.exists(LEGACY_CACHE_FILE):
+        with open(LEGACY_CACHE_FILE, 'rb') as f:
+            df = pickle.load(f)
+        save_cache(df)
+        st.info("Loaded data from legacy pickle cache and converted it to Feather.")
     else:
         query = """
         SELECT * FROM `stellar-river-464405-k3.steam_data.cleaned_steam_games`
         """
         df = client.query(query).to_dataframe()
-        with open(CACHE_FILE, 'wb') as f:
-            pickle.dump(df, f)
+        save_cache(df)
         st.info("Fetched data from BigQuery and saved to cache.")
     return df
 
-# Function to clean and combine text features
+# Function to clean text features (lowercase, remove punctuation)
 def clean_text(text):
-    if isinstance(text, (list, np.ndarray)):
-        text = ' '.join([str(item) for item in text])
-    elif isinstance(text, str):
-        text = text
-    else:
-        text = str(text)
-    text = re.sub(r'[^\w\s]', '', text.lower())
-    return text
+    return text.str.lower().str.replace(CLEAN_TEXT_RE, '', regex=True)
+
+# Function to build per-game token lists from the list-valued genre and tags
+# columns. Each distinct token is cleaned once instead of re-joining and
+# re-tokenizing every row.
+def build_token_lists(genres, tags):
+    distinct = pd.Series(pd.concat([genres.explode(), tags.explode()]).dropna().unique()).astype(str)
+    cleaned = dict(zip(distinct, clean_text(distinct)))
+    return [
+        [cleaned[t] for t in (*g, *tg) if cleaned[t]]
+        for g, tg in zip(genres, tags)
+    ]
+
+# Analyzer for pre-tokenized documents
+def identity_analyzer(tokens):
+    return tokens
+
+# Fingerprint of a DataFrame's combined features, used to key the model caches
+def features_fingerprint(df):
+    return hashlib.md5(pd.util.hash_pandas_object(df['combined_features'].str.join('|'), index=False).values).hexdigest()
+
+# Load and preprocess data. Streamlit re-executes this whole script on every
+# interaction, so loading, tokenizing and fingerprinting are cached per process.
+@st.cache_resource
+def load_games():
+    df = load_data()
+    df['combined_features'] = build_token_lists(df['genre'], df['tags'])
+    return df, features_fingerprint(df)
+
+df, fingerprint = load_games()
 
-# Load and preprocess data
-df = load_data()
-df['combined_features'] = df['genre'].apply(clean_text) + ' ' + df['tags'].apply(clean_text)
+# Lookup from lowercase game name to row position (first occurrence wins),
+# built once per dataset rather than on every script rerun
+@st.cache_resource
+def build_name_index(_df, fingerprint):
+    name_index = {}
+    for i, name in enumerate(_df['name'].astype(str).str.lower()):
+        name_index.setdefault(name, i)
+    return name_index
+
+name_index = build_name_index(df, fingerprint)
+
+# Game names for the dropdown, sorted once per dataset rather than on every rerun
+@st.cache_data
+def sorted_names(_df, fingerprint):
+    return _df['name'].sort_values().tolist()
+
+# Function to load the TF-IDF matrix from disk, fitting and saving it on a miss.
+# The matrix is written to a temporary file and renamed into place so an
+# interrupted save never leaves a truncated cache behind.
+def load_tfidf_matrix(features, fingerprint):
+    matrix_file = TFIDF_MATRIX_FILE.format(fingerprint=fingerprint)
+    if os.path.exists(matrix_file):
+        return scipy.sparse.load_npz(matrix_file).astype(np.float32, copy=False)
+    tfidf = TfidfVectorizer(analyzer=identity_analyzer, lowercase=False, max_features=5000, dtype=np.float32)
+    tfidf_matrix = tfidf.fit_transform(features)
+    tmp_file = f"{matrix_file}.tmp.npz"
+    scipy.sparse.save_npz(tmp_file, tfidf_matrix, compressed=False)
+    os.replace(tmp_file, matrix_file)
+    return tfidf_matrix
 
-# Create TF-IDF vectorizer and similarity matrix
+# Create TF-IDF vectorizer and densify its L2-normalized rows. The vocabulary
+# is the set of genres and tags (a few hundred), so the dense rows stay small
+# and a dot product against one row gives its exact TF-IDF cosine similarity to
+# every game without materializing an N x N matrix.
 @st.cache_resource
-def compute_similarity_matrix():
-    tfidf = TfidfVectorizer(stop_words='english', max_features=5000)
-    tfidf_matrix = tfidf.fit_transform(df['combined_features'])
-    cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-    return cosine_sim
+def compute_similarity_matrix(_df, fingerprint):
+    tfidf_matrix = load_tfidf_matrix(_df['combined_features'], fingerprint)
+    embeddings = normalize(tfidf_matrix, norm='l2', copy=False).toarray()
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
 
-cosine_sim = compute_similarity_matrix()
+# Quantize the embeddings to int8 with a single global scale for the exact
+# scan; ranking only needs the order of the scores, which 8 bits preserves
+@st.cache_resource
+def quantize_embeddings(_embeddings, fingerprint):
+    scale = 127 / np.abs(_embeddings).max()
+    embeddings_q = np.clip(np.rint(_embeddings * scale), -127, 127).astype(np.int8)
+    return np.ascontiguousarray(embeddings_q), scale
+
+# Dot product of row i against every row of a (quantized) row-normalized matrix
+@njit(parallel=True, fastmath=True, cache=True)
+def cos_row(X, i, out):
+    for j in prange(X.shape[0]):
+        s = 0.0
+        for k in range(X.shape[1]):
+            s += X[i, k] * X[j, k]
+        out[j] = s
+
+# Collapse games with identical feature rows. Many games share the same genres
+# and tags, and HNSW misses neighbours when the graph is full of exact
+# duplicates, so the index holds each distinct row once and every hit is mapped
+# back to all of its games.
+@st.cache_resource
+def dedupe_embeddings(_embeddings, fingerprint):
+    unique_rows, inverse = np.unique(_embeddings, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    members = np.argsort(inverse, kind='stable')
+    bounds = np.searchsorted(inverse[members], np.arange(1, len(unique_rows)))
+    return np.ascontiguousarray(unique_rows), np.split(members, bounds)
+
+# Build (or load from disk) an HNSW index over the distinct embeddings
+@st.cache_resource
+def load_ann_index(_embeddings, fingerprint):
+    if hnswlib is None:
+        return None
+    num_elements, dim = _embeddings.shape
+    index_file = INDEX_FILE.format(fingerprint=fingerprint)
+    if os.path.exists(index_file):
+        index = hnswlib.Index(space='cosine', dim=dim)
+        index.load_index(index_file)
+        if index.get_current_count() == num_elements:
+            index.set_ef(HNSW_EF)
+            return index
+    index = hnswlib.Index(space='cosine', dim=dim)
+    index.init_index(max_elements=num_elements, ef_construction=200, M=16)
+    index.add_items(_embeddings, np.arange(num_elements))
+    index.save_index(index_file)
+    index.set_ef(HNSW_EF)
+    return index
+
+# Function to select the indices of the top_n highest scores, excluding the
+# query game itself (games with identical features tie with it at 1.0)
+def top_k(scores, idx, top_n):
+    k = min(top_n, len(scores) - 1)
+    part = np.argpartition(-scores, k)[:k + 1]
+    order = part[np.argsort(-scores[part])]
+    return order[order != idx][:top_n]
+
+embeddings = compute_similarity_matrix(df, fingerprint)
+unique_embeddings, duplicate_groups = dedupe_embeddings(embeddings, fingerprint)
+ann_index = load_ann_index(unique_embeddings, fingerprint)
 
 # Function to get recommendations
-def get_recommendations(game_name, cosine_sim=cosine_sim, df=df, top_n=5):
-    try:
-        idx = df[df['name'].str.lower() == game_name.lower()].index[0]
-    except IndexError:
+def get_recommendations(game_name, embeddings=embeddings, ann_index=ann_index, duplicate_groups=duplicate_groups,
+                        df=df, name_index=name_index, fingerprint=fingerprint, top_n=5):
+    idx = name_index.get(game_name.lower())
+    if idx is None:
         return f"Game '{game_name}' not found in the dataset."
     
-    sim_scores = list(enumerate(cosine_sim[idx]))
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-    sim_scores = sim_scores[1:top_n+1]
-    game_indices = [i[0] for i in sim_scores]
+    if ann_index is not None:
+        labels, distances = ann_index.knn_query(embeddings[idx], k=min(top_n + 1, len(duplicate_groups)))
+        groups = [duplicate_groups[label] for label in labels[0]]
+        game_indices = np.concatenate(groups)
+        scores = np.repeat(1 - distances[0], [len(group) for group in groups])
+        keep = game_indices != idx
+        game_indices = game_indices[keep][:top_n]
+        similarity_scores = scores[keep][:top_n]
+    else:
+        embeddings_q, embedding_scale = quantize_embeddings(embeddings, fingerprint)
+        scores = np.empty(len(embeddings_q), dtype=np.float32)
+        cos_row(embeddings_q, idx, scores)
+        game_indices = top_k(scores, idx, top_n)
+        similarity_scores = scores[game_indices] / embedding_scale ** 2
     recommendations = df[['name', 'genre', 'tags']].iloc[game_indices].copy()
-    recommendations['similarity_score'] = [i[1] for i in sim_scores]
+    recommendations['similarity_score'] = similarity_scores
     return recommendations
 
 # Streamlit UI
@@ -82,7 +225,7 @@ def main():
     st.write("Select a game to get recommendations for similar games based on genre and tags.")
 
     # Dropdown to select a game
-    game_name = st.selectbox("Choose a game:", df['name'].sort_values().tolist(), index=0)
+    game_name = st.selectbox("Choose a game:", sorted_names(df, fingerprint), index=0)
 
     # Button to get recommendations
     if st.button("Get Recommendations"):
@@ -6,6 +6,17 @@ from airflow.providers.google.cloud.transfers.gcs_to_bigquery import GCSToBigQue
 from datetime import datetime, timedelta
 from steam_etl import extract_and_upload
 
+# Columns compared by the SCD merge to detect a changed game record
+SCD_TRACKED_COLUMNS = [
+    'name', 'genre', 'tags', 'positive', 'negative', 'developer', 'publisher', 'score_rank', 'owners',
+    'min_owners', 'max_owners', 'average_forever', 'average_2weeks', 'median_forever', 'median_2weeks',
+    'ccu', 'price', 'initialprice', 'discount', 'languages',
+]
+
+def row_hash_sql(alias):
+    columns = ', '.join(f'{alias}.{column}' for column in SCD_TRACKED_COLUMNS)
+    return f'FARM_FINGERPRINT(TO_JSON_STRING(STRUCT({columns})))'
+
 default_args = {
     'owner': 'airflow',
     'depends_on_past': False,
@@ -84,6 +95,7 @@ with DAG(
             {'name': 'initialprice', 'type': 'FLOAT64'},
             {'name': 'discount', 'type': 'FLOAT64'},
             {'name': 'languages', 'type': 'STRING', 'mode': 'REPEATED'},
+            {'name': 'row_hash', 'type': 'INTEGER'},
             {'name': 'valid_from', 'type': 'DATE'},
             {'name': 'valid_to', 'type': 'DATE', 'mode': 'NULLABLE'},
             {'name': 'is_active', 'type': 'BOOLEAN'}
@@ -127,44 +139,30 @@ with DAG(
         task_id='apply_scd_merge',
         configuration={
             'query': {
-                'query': '''
+                'query': f'''
+                    ALTER TABLE `stellar-river-464405-k3.steam_data.cleaned_steam_games`
+                    ADD COLUMN IF NOT EXISTS row_hash INT64;
+
                     MERGE `stellar-river-464405-k3.steam_data.cleaned_steam_games` T
-                    USING `stellar-river-464405-k3.steam_data.cleaned_steam_games_staging` S
+                    USING (
+                        SELECT *, {row_hash_sql('staging')} AS row_hash
+                        FROM `stellar-river-464405-k3.steam_data.cleaned_steam_games_staging` staging
+                    ) S
                     ON T.appid = S.appid
 
-                    WHEN MATCHED AND T.is_active = TRUE AND (
-                        T.name != S.name OR
-                        ARRAY_TO_STRING(T.genre, ',') != ARRAY_TO_STRING(S.genre, ',') OR
-                        ARRAY_TO_STRING(T.tags, ',') != ARRAY_TO_STRING(S.tags, ',') OR
-                        T.positive != S.positive OR
-                        T.negative != S.negative OR
-                        T.developer != S.developer OR
-                        T.publisher != S.publisher OR
-                        T.score_rank != S.score_rank OR
-                        T.owners != S.owners OR
-                        T.min_owners != S.min_owners OR
-                        T.max_owners != S.max_owners OR
-                        T.average_forever != S.average_forever OR
-                        T.average_2weeks != S.average_2weeks OR
-                        T.median_forever != S.median_forever OR
-                        T.median_2weeks != S.median_2weeks OR
-                        T.ccu != S.ccu OR
-                        T.price != S.price OR
-                        T.initialprice != S.initialprice OR
-                        T.discount != S.discount OR
-                        ARRAY_TO_STRING(T.languages, ',') != ARRAY_TO_STRING(S.languages, ',')
-                    ) THEN
+                    WHEN MATCHED AND T.is_active = TRUE
+                        AND COALESCE(T.row_hash, {row_hash_sql('T')}) != S.row_hash THEN
                         UPDATE SET T.valid_to = S.load_date, T.is_active = FALSE
 
                     WHEN NOT MATCHED THEN
                         INSERT (appid, name, genre, tags, positive, negative, developer, publisher,
                                 score_rank, owners, min_owners, max_owners, average_forever, average_2weeks,
                                 median_forever, median_2weeks, ccu, price, initialprice, discount, languages,
-                                valid_from, valid_to, is_active)
+                                row_hash, valid_from, valid_to, is_active)
                         VALUES (S.appid, S.name, S.genre, S.tags, S.positive, S.negative, S.developer,
                                 S.publisher, S.score_rank, S.owners, S.min_owners, S.max_owners, S.average_forever,
                                 S.average_2weeks, S.median_forever, S.median_2weeks, S.ccu, S.price,
-                                S.initialprice, S.discount, S.languages, S.load_date, NULL, TRUE)
+                                S.initialprice, S.discount, S.languages, S.row_hash, S.load_date, NULL, TRUE);
                 ''',
                 'useLegacySql': False,
             }
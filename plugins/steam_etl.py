@@ -1,59 +1,141 @@
+import asyncio
 import requests
 import time
 import logging
+import httpx
+import pandas as pd
+from aiolimiter import AsyncLimiter
 from google.cloud import storage
 from google.cloud import bigquery
 from datetime import datetime
-import json
+import orjson
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from concurrent.futures import ThreadPoolExecutor
 
+STEAMSPY_RETRY_STATUSES = {429, 500, 502, 503, 504}
+STEAMSPY_MAX_CONCURRENCY = 30
+# SteamSpy allows one appdetails request per second; faster rates get 429s
+STEAMSPY_REQUESTS_PER_SECOND = 1
+# SteamSpy allows one "all" request per minute
+STEAMSPY_ALL_PAGE_INTERVAL = 60
+
+STEAMSPY_FIELDS = [
+    "name", "genre", "tags", "positive", "negative", "developer", "publisher", "score_rank", "owners",
+    "average_forever", "average_2weeks", "median_forever", "median_2weeks", "ccu", "price", "initialprice",
+    "discount", "languages",
+]
+STEAMSPY_COUNT_FIELDS = [
+    "positive", "negative", "average_forever", "average_2weeks", "median_forever", "median_2weeks", "ccu",
+]
+
 def get_steamspy_api_session():
     session = requests.Session()
     retries = Retry(total=5, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504])
-    session.mount('https://', HTTPAdapter(max_retries=retries))
+    adapter = HTTPAdapter(
+        pool_connections=STEAMSPY_MAX_CONCURRENCY, pool_maxsize=STEAMSPY_MAX_CONCURRENCY, max_retries=retries
+    )
+    session.mount('https://', adapter)
     return session
 
-def fetch_app_list():
-    logging.info("Fetching app list from Steam official API")
-    session = get_steamspy_api_session()
+# Shared session so every synchronous SteamSpy request reuses the same connection pool
+steamspy_session = get_steamspy_api_session()
+
+def get_steamspy_async_client():
+    limits = httpx.Limits(
+        max_connections=STEAMSPY_MAX_CONCURRENCY, max_keepalive_connections=STEAMSPY_MAX_CONCURRENCY
+    )
+    return httpx.AsyncClient(transport=httpx.AsyncHTTPTransport(retries=3, limits=limits))
+
+def fetch_app_list(max_pages=None):
+    logging.info("Fetching app list from SteamSpy")
+    all_apps = {}
+    page = 0
     try:
-        response = session.get("https://api.steampowered.com/ISteamApps/GetAppList/v2/", timeout=20)
-        response.raise_for_status()
-        apps = response.json()["applist"]["apps"]
-        app_ids = [app["appid"] for app in apps if app.get("appid")]
-        logging.info(f"Fetched {len(app_ids)} total app IDs")
-        return app_ids
+        while max_pages is None or page < max_pages:
+            if page:
+                time.sleep(STEAMSPY_ALL_PAGE_INTERVAL)
+            response = steamspy_session.get(f"https://steamspy.com/api.php?request=all&page={page}", timeout=60)
+            response.raise_for_status()
+            apps = response.json()
+            if not apps:
+                break
+            all_apps.update(apps)
+            page += 1
     except Exception as e:
-        logging.error(f"Failed to fetch app list: {e}")
-        return []
+        if not all_apps:
+            raise
+        logging.warning(f"App list is partial: page {page} failed after {page} pages were fetched: {e}")
+    app_ids = [int(appid) for appid in all_apps]
+    logging.info(f"Fetched {len(app_ids)} app IDs from {page} pages")
+    return app_ids
 
-def fetch_app_details(appid, session):
+async def fetch_one(client, appid, limiter, retries=5, backoff_factor=2):
     url = f"https://steamspy.com/api.php?request=appdetails&appid={appid}"
     try:
-        response = session.get(url, timeout=10)
+        for attempt in range(retries + 1):
+            async with limiter:
+                response = await client.get(url, timeout=10)
+            if response.status_code not in STEAMSPY_RETRY_STATUSES or attempt == retries:
+                break
+            await asyncio.sleep(backoff_factor * 2 ** attempt)
         response.raise_for_status()
-        data = json.loads(response.text)
+        data = response.json()
         if data and data.get("appid") != 999999:
             return data
         else:
             return None
-    except Exception:
+    except Exception as e:
+        logging.warning(f"Dropping app {appid} from SteamSpy results: {e}")
         return None
 
-def validate_app_ids(app_ids, session, sample_size=100):
-    logging.info(f"Validating sample of {sample_size} app IDs")
-    valid_ids = []
-    sample = app_ids[:sample_size]
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        results = [executor.submit(fetch_app_details, appid, session) for appid in sample]
-        for appid, future in zip(sample, results):
-            if future.result():
-                valid_ids.append(appid)
-    success_rate = len(valid_ids) / len(sample) if sample else 0
-    logging.info(f"Validation success rate: {success_rate:.2%}")
-    return app_ids[:int(len(app_ids) * success_rate * 1.5)]
+async def fetch_app_details(client, app_ids, limiter):
+    semaphore = asyncio.Semaphore(STEAMSPY_MAX_CONCURRENCY)
+    async def fetch_bounded(appid):
+        async with semaphore:
+            return await fetch_one(client, appid, limiter)
+    return await asyncio.gather(*(fetch_bounded(appid) for appid in app_ids))
+
+def to_json_lines(records):
+    return b"\n".join(orjson.dumps(record) for record in records)
+
+def split_list_column(col):
+    tokens = col.fillna("").astype(str).str.split(",").explode().str.strip()
+    lists = tokens[tokens != ""].groupby(level=0).agg(list).reindex(col.index)
+    return lists.map(lambda v: v if isinstance(v, list) else [])
+
+def with_default(col, default):
+    return col.mask(col.isna() | (col == ""), default)
+
+def parse_price(col):
+    return pd.to_numeric(col.replace("Free to Play", 0), errors="coerce").fillna(0) / 100
+
+def clean_app_details(appids, app_data, load_date):
+    raw_df = pd.DataFrame(app_data, columns=STEAMSPY_FIELDS)
+    owners_split = (
+        raw_df["owners"].fillna("0 .. 0").astype(str).str.replace(",", "", regex=False)
+        .str.split(" .. ", n=1, expand=True, regex=False).reindex(columns=[0, 1])
+    )
+    min_owners = pd.to_numeric(owners_split[0], errors="coerce").fillna(0).astype("int64")
+    max_owners = pd.to_numeric(owners_split[1], errors="coerce").fillna(min_owners).astype("int64")
+
+    cleaned = pd.DataFrame({"appid": appids, "name": raw_df["name"]})
+    cleaned["genre"] = split_list_column(raw_df["genre"])
+    cleaned["tags"] = raw_df["tags"].map(lambda d: sorted({tag.lower() for tag in d}) if isinstance(d, dict) else [])
+    cleaned["developer"] = with_default(raw_df["developer"], "Unknown")
+    cleaned["publisher"] = with_default(raw_df["publisher"], "Unknown")
+    cleaned["score_rank"] = with_default(raw_df["score_rank"], "N/A")
+    cleaned["owners"] = raw_df["owners"]
+    cleaned["min_owners"] = min_owners
+    cleaned["max_owners"] = max_owners
+    for field in STEAMSPY_COUNT_FIELDS:
+        cleaned[field] = pd.to_numeric(raw_df[field], errors="coerce").fillna(0).astype("int64")
+    cleaned["price"] = parse_price(raw_df["price"])
+    cleaned["initialprice"] = parse_price(raw_df["initialprice"])
+    cleaned["discount"] = pd.to_numeric(raw_df["discount"], errors="coerce").fillna(0).astype("float64")
+    cleaned["languages"] = split_list_column(raw_df["languages"])
+    cleaned["load_date"] = load_date
+    return cleaned
 
 def extract_and_upload(**kwargs):
     execution_date = kwargs.get("ds")
@@ -61,6 +143,7 @@ def extract_and_upload(**kwargs):
     conf = kwargs.get("dag_run").conf or {}
     is_initial_load = conf.get("is_initial_load", False)
     max_apps = conf.get("max_apps", None)
+    max_pages = conf.get("max_pages", None)
 
     storage_client = storage.Client()
     bucket = storage_client.bucket("us-central1-composer-dev-33ed7046-bucket")
@@ -68,10 +151,7 @@ def extract_and_upload(**kwargs):
     dataset_id = "steam_data"
     table_id = "cleaned_steam_games"
 
-    session = get_steamspy_api_session()
-    app_ids = fetch_app_list()
-
-    app_ids = validate_app_ids(app_ids, session)
+    app_ids = fetch_app_list(max_pages)
 
     if not is_initial_load:
         query = f"SELECT DISTINCT appid FROM `{bq_client.project}.{dataset_id}.{table_id}`"
@@ -83,75 +163,44 @@ def extract_and_upload(**kwargs):
     if max_apps:
         app_ids = app_ids[:max_apps]
 
-    def fetch_batch(app_ids_batch):
-        results = []
-        for appid in app_ids_batch:
-            time.sleep(2.0)
-            app_data = fetch_app_details(appid, session)
-            if not app_data:
-                continue
-            tags_data = app_data.get("tags", {})
-            tags = list(set(tag.lower() for tag in tags_data.keys())) if isinstance(tags_data, dict) else []
-            owners_range = app_data.get("owners", "0 .. 0").replace(",", "").split(" .. ")
-            min_owners = int(owners_range[0]) if owners_range else 0
-            max_owners = int(owners_range[1]) if len(owners_range) > 1 else min_owners
-            genre_raw = app_data.get("genre")
-            genres = [g.strip() for g in genre_raw.split(",")] if genre_raw else []
-            # genres = [g.strip() for g in app_data.get("genre", "").split(",") if g.strip()]
-            languages_raw = app_data.get("languages", "") or ""
-            languages = [l.strip() for l in languages_raw.split(",") if l.strip()]
-            price = float(app_data.get("price", 0)) / 100 if app_data.get("price") not in [None, "Free to Play"] else 0
-            initialprice = float(app_data.get("initialprice", 0)) / 100 if app_data.get("initialprice") not in [None, "Free to Play"] else 0
-            discount = float(app_data.get("discount", 0)) if app_data.get("discount") else 0
-            result = {
-                "raw": {
-                    "appid": appid,
-                    "name": app_data.get("name"),
-                    "data": app_data,
-                    "load_date": execution_date
-                },
-                "cleaned": {
-                    "appid": appid,
-                    "name": app_data.get("name"),
-                    "genre": genres,
-                    "tags": tags,
-                    "positive": app_data.get("positive", 0),
-                    "negative": app_data.get("negative", 0),
-                    "developer": app_data.get("developer") or "Unknown",
-                    "publisher": app_data.get("publisher") or "Unknown",
-                    "score_rank": app_data.get("score_rank") or "N/A",
-                    "owners": app_data.get("owners"),
-                    "min_owners": min_owners,
-                    "max_owners": max_owners,
-                    "average_forever": app_data.get("average_forever", 0),
-                    "average_2weeks": app_data.get("average_2weeks", 0),
-                    "median_forever": app_data.get("median_forever", 0),
-                    "median_2weeks": app_data.get("median_2weeks", 0),
-                    "ccu": app_data.get("ccu", 0),
-                    "price": price,
-                    "initialprice": initialprice,
-                    "discount": discount,
-                    "languages": languages,
-                    "load_date": execution_date
-                }
-            }
-            results.append(result)
-        return results
-
-    raw_data = []
-    cleaned_data = []
+    async def fetch_batch(client, app_ids_batch, limiter):
+        details = await fetch_app_details(client, app_ids_batch, limiter)
+        found = [(appid, app_data) for appid, app_data in zip(app_ids_batch, details) if app_data]
+        raw_data = [
+            {"appid": appid, "name": app_data.get("name"), "data": app_data, "load_date": execution_date}
+            for appid, app_data in found
+        ]
+        if not found:
+            return raw_data, None
+        appids, app_data = zip(*found)
+        return raw_data, clean_app_details(list(appids), list(app_data), execution_date)
+
     batch_size = 200
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        batches = [app_ids[i:i+batch_size] for i in range(0, len(app_ids), batch_size)]
-        for i, batch_results in enumerate(executor.map(fetch_batch, batches)):
-            for result in batch_results:
-                raw_data.append(result["raw"])
-                cleaned_data.append(result["cleaned"])
-            if not raw_data:
-                break
-            raw_blob = bucket.blob(f"raw/steam_games_{execution_date}_{i+1}.json")
-            raw_blob.upload_from_string("\n".join(json.dumps(d) for d in raw_data))
-            cleaned_blob = bucket.blob(f"processed/steam_games_cleaned_{execution_date}_{i+1}.json")
-            cleaned_blob.upload_from_string("\n".join(json.dumps(d) for d in cleaned_data))
-            raw_data = []
-            cleaned_data = []
\ No newline at end of file
+    batches = [app_ids[i:i+batch_size] for i in range(0, len(app_ids), batch_size)]
+
+    async def fetch_and_upload_batches(upload_pool):
+        uploads = []
+        # The limiter is bound to this run's event loop, so it is created here rather than at import
+        limiter = AsyncLimiter(STEAMSPY_REQUESTS_PER_SECOND, 1)
+        # One client for the whole run so connections are reused across batches
+        async with get_steamspy_async_client() as client:
+            for i, batch in enumerate(batches):
+                raw_data, cleaned_df = await fetch_batch(client, batch, limiter)
+                if not raw_data:
+                    break
+                # Uploads run in the background while the next batch is fetched
+                raw_blob = bucket.blob(f"raw/steam_games_{execution_date}_{i+1}.json")
+                uploads.append(upload_pool.submit(
+                    raw_blob.upload_from_string, to_json_lines(raw_data), content_type="application/json"
+                ))
+                cleaned_blob = bucket.blob(f"processed/steam_games_cleaned_{execution_date}_{i+1}.json")
+                uploads.append(upload_pool.submit(
+                    cleaned_blob.upload_from_string, cleaned_df.to_json(orient="records", lines=True),
+                    content_type="application/json"
+                ))
+        return uploads
+
+    with ThreadPoolExecutor(max_workers=4) as upload_pool:
+        uploads = asyncio.run(fetch_and_upload_batches(upload_pool))
+    for upload in uploads:
+        upload.result()
\ No newline at end of file